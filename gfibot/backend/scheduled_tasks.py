@@ -265,7 +265,12 @@ def update_gfi_info(token: str, owner: str, name: str, send_email: bool = False)
 
         # 2. rebuild repo dataset
         begin_datetime = datetime(2008, 1, 1)
-        get_dataset_for_repo(owner=owner, name=name, since=begin_datetime)
+        get_dataset_for_repo(
+            owner=owner,
+            name=name,
+            since=begin_datetime,
+            n_process=CONFIG["gfibot"]["dataset_n_process"] or None,
+        )
 
         # 3. update training summary
         # 4. update gfi prediction
@@ -308,6 +308,9 @@ class RepoCommit(Document):
             {"fields": ["authored_at"]},
             {"fields": ["committer"]},
             {"fields": ["committed_at"]},
+            # for per-user commit counts in dataset building
+            {"fields": ["owner", "name", "committer", "committed_at"]},
+            {"fields": ["owner", "name", "author", "authored_at"]},
         ]
     }
 
@@ -345,6 +348,8 @@ class RepoIssue(Document):
             {"fields": ["owner", "name", "number"], "unique": True},
             {"fields": ["is_pull"]},
             {"fields": ["created_at"]},
+            # for per-user issue counts in dataset building
+            {"fields": ["owner", "name", "user", "created_at"]},
         ],
     }
 
@@ -1,15 +1,18 @@
 import os
 import re
+import bisect
+import functools
+import itertools
 import nltk
 import logging
+import statistics
 import textstat
 import argparse
 import mongoengine
-import numpy as np
 import multiprocessing as mp
 
-from typing import Union
-from collections import Counter
+from typing import Deque, Dict, FrozenSet, NamedTuple, Set, Tuple, Union
+from collections import Counter, deque
 from dateutil.parser import parse as parse_date
 from gfibot import CONFIG
 from gfibot.collections import *
@@ -17,58 +20,54 @@ from mongoengine.queryset.visitor import Q
 
 logger = logging.getLogger(__name__)
 
+_CODE_RE = re.compile(r"```.+?```", flags=re.S)
+_URL_RE = re.compile(r"http[:/\w\.]+")
+_WORD_RE = re.compile(r"\w+")
+_IMG_SUFFIXES = ("jpg", "jpeg", "png")
+
 
 def _count_code_snippets(s: str) -> int:
-    p = re.compile(r"```.+?```", flags=re.S)
     if s is None:
         return 0
-    return len(p.findall(s))
+    return len(_CODE_RE.findall(s))
 
 
 def _delete_code_snippets(s: str) -> str:
     if s is None:
         return ""
-    p = re.compile(r"```.+?```", flags=re.S)
-    s = p.sub("", s)
+    s = _CODE_RE.sub("", s)
     # return " ".join(s.split())
     return s
 
 
-def _count_urls(s: str) -> int:
+def _scan_urls(s: str) -> Tuple[int, int]:
+    """Count URLs and image URLs in a single pass, returns (n_urls, n_imgs)"""
     if s is None:
-        return 0
-    p = re.compile(r"http[:/\w\.]+")
-    lst = list(
-        filter(  # do not count images, this will be done in count_imgs()
-            lambda s2: not (
-                s2.endswith("jpg") or s2.endswith("jpeg") or s2.endswith("png")
-            ),
-            p.findall(s),
-        )
-    )
-    return len(lst)
+        return 0, 0
+    n_urls, n_imgs = 0, 0
+    for m in _URL_RE.finditer(s):
+        if m.group().endswith(_IMG_SUFFIXES):
+            n_imgs += 1
+        else:
+            n_urls += 1
+    return n_urls, n_imgs
+
+
+def _count_urls(s: str) -> int:
+    # do not count images, this will be done in count_imgs()
+    return _scan_urls(s)[0]
 
 
 def _delete_urls(s: str) -> str:
     if s == None:
         return ""
-    p = re.compile(r"http[:/\w\.]+")
-    s = p.sub("", s)
+    s = _URL_RE.sub("", s)
     # return " ".join(s.split())
     return s
 
 
 def _count_imgs(s: str) -> int:
-    if s is None:
-        return 0
-    p = re.compile(r"http[:/\w\.]+")
-    lst = list(
-        filter(
-            lambda s2: s2.endswith("jpg") or s2.endswith("jpeg") or s2.endswith("png"),
-            p.findall(s),
-        )
-    )
-    return len(lst)
+    return _scan_urls(s)[1]
 
 
 def _count_text_len(s: str) -> int:
@@ -77,78 +76,147 @@ def _count_text_len(s: str) -> int:
     return len(s.split())
 
 
-def _get_categorized_labels(labels: List[str]) -> Dataset.LabelCategory:
-    keyword_rules = {
-        "bug": ["bug"],
-        "feature": ["feature"],
-        "test": ["test", "testing"],
-        "build": ["ci", "build"],
-        "doc": ["doc", "document", "documentation"],
-        "coding": ["code", "coding", "program", "programming"],
-        "enhance": ["enhance", "enhancement"],
-        "gfi": [
-            "easy",
-            "starter",
-            "newbie",
-            "beginner",
-            "starter",
-            "minor",
-            "novice",
-            ("good", "first"),
-            ("low", "fruit"),
-            ("effort", "low"),
-            ("first", "time"),
-            ("first", "timer"),
-            ("first", "pr"),
-            ("up", "for", "grab"),
-        ],
-        "medium": ["medium", "intermediate"],
-        "major": [
-            "important",
-            "major",
-            "breaking",
-            "difficult",
-            "hard",
-            "core",
-            "serious",
-            ("priority", "p1"),
-            ("priority", "high"),
-            ("priority", "critical"),
-        ],
-        "triaged": [
-            "triaged",
-            "triage",
-            "progress",
-            "haspr",
-            "fixed",
-            "wontfix",
-            ("ha", "pr"),
-            ("ha", "fix"),
-        ],
-        "untriaged": [
-            "untriaged",
-            ("need", "triage"),
-            ("needed", "triage"),
-            ("no", "triage"),
-        ],
-    }
+class _BodyFeatures(NamedTuple):
+    n_code_snips: int
+    n_urls: int
+    n_imgs: int
+    len_body: int
+    clean_body: str
+
+
+@functools.lru_cache(maxsize=4096)
+def _analyze_body(s: str) -> _BodyFeatures:
+    """
+    Compute all content features of an issue body with as few passes as possible.
+    Code snippets, URLs and images are counted on the raw body, while the clean
+        body has code snippets and then URLs removed (same as the _count/_delete helpers).
+    Results are memoized: resolved issues are built twice and template bodies repeat.
+    """
+    if s is None:
+        return _BodyFeatures(0, 0, 0, 0, "")
+    n_code_snips, parts, last = 0, [], 0
+    for m in _CODE_RE.finditer(s):
+        n_code_snips += 1
+        parts.append(s[last : m.start()])
+        last = m.end()
+    parts.append(s[last:])
+    clean_body = _URL_RE.sub("", "".join(parts))
+    n_urls, n_imgs = _scan_urls(s)
+    return _BodyFeatures(
+        n_code_snips, n_urls, n_imgs, len(clean_body.split()), clean_body
+    )
+
+
+@functools.lru_cache(maxsize=4096)
+def _readability_all(s: str) -> Tuple[float, float, float, float]:
+    """
+    Returns Coleman-Liau index, Flesch reading ease, Flesch-Kincaid grade
+        and automated readability index of a text.
+    They are computed back to back so that textstat's per-text caches of
+        word/sentence/syllable/letter counts are shared among the four indices.
+    """
+    return (
+        textstat.coleman_liau_index(s),
+        textstat.flesch_reading_ease(s),
+        textstat.flesch_kincaid_grade(s),
+        textstat.automated_readability_index(s),
+    )
 
+
+_LABEL_KEYWORD_RULES = {
+    "bug": ["bug"],
+    "feature": ["feature"],
+    "test": ["test", "testing"],
+    "build": ["ci", "build"],
+    "doc": ["doc", "document", "documentation"],
+    "coding": ["code", "coding", "program", "programming"],
+    "enhance": ["enhance", "enhancement"],
+    "gfi": [
+        "easy",
+        "starter",
+        "newbie",
+        "beginner",
+        "starter",
+        "minor",
+        "novice",
+        ("good", "first"),
+        ("low", "fruit"),
+        ("effort", "low"),
+        ("first", "time"),
+        ("first", "timer"),
+        ("first", "pr"),
+        ("up", "for", "grab"),
+    ],
+    "medium": ["medium", "intermediate"],
+    "major": [
+        "important",
+        "major",
+        "breaking",
+        "difficult",
+        "hard",
+        "core",
+        "serious",
+        ("priority", "p1"),
+        ("priority", "high"),
+        ("priority", "critical"),
+    ],
+    "triaged": [
+        "triaged",
+        "triage",
+        "progress",
+        "haspr",
+        "fixed",
+        "wontfix",
+        ("ha", "pr"),
+        ("ha", "fix"),
+    ],
+    "untriaged": [
+        "untriaged",
+        ("need", "triage"),
+        ("needed", "triage"),
+        ("no", "triage"),
+    ],
+}
+
+# A label word matches a single-word rule if the rule is a substring of it,
+#   multi-word rules (tuples) match if all of their words appear in the label
+_SINGLE_RULES: List[Tuple[str, str]] = [
+    (rule, cat)
+    for cat, rules in _LABEL_KEYWORD_RULES.items()
+    for rule in rules
+    if isinstance(rule, str)
+]
+_TUPLE_RULES: List[Tuple[FrozenSet[str], str]] = [
+    (frozenset(rule), cat)
+    for cat, rules in _LABEL_KEYWORD_RULES.items()
+    for rule in rules
+    if isinstance(rule, tuple)
+]
+
+
+# WordNet itself is loaded lazily on first use (corpora are downloaded in gfibot/__init__.py)
+_LEMMATIZER = nltk.stem.WordNetLemmatizer()
+
+
+@functools.lru_cache(maxsize=8192)
+def _lemmatize(word: str) -> str:
+    return _LEMMATIZER.lemmatize(word)
+
+
+@functools.lru_cache(maxsize=8192)
+def _get_word_categories(word: str) -> FrozenSet[str]:
+    """Inverted index from a (lemmatized) label word to the categories it matches"""
+    return frozenset(cat for rule, cat in _SINGLE_RULES if rule in word)
+
+
+def _get_categorized_labels(labels: List[str]) -> Dataset.LabelCategory:
     label_cat = Counter()
-    lemmatizer = nltk.stem.WordNetLemmatizer()
     for label in labels:
-        words = re.compile(r"\w+").findall(label.lower().replace("_", " "))
-        words = [lemmatizer.lemmatize(w) for w in words]
-        for cat, rules in keyword_rules.items():
-            match = 0
-            for rule in rules:
-                if isinstance(rule, (tuple, list)):
-                    if all(word in words for word in rule):
-                        match = 1
-                elif rule in words:
-                    match = 1
-                elif any(rule in w for w in words):
-                    match = 1
-            label_cat[cat] += match
+        words = _WORD_RE.findall(label.lower().replace("_", " "))
+        word_set = set(_lemmatize(w) for w in words)
+        cats = set().union(*(_get_word_categories(w) for w in word_set))
+        cats.update(cat for rule, cat in _TUPLE_RULES if rule <= word_set)
+        label_cat.update(cats)
     return Dataset.LabelCategory(**label_cat)
 
 
@@ -156,153 +224,272 @@ def _get_user_data(
     owner: str, name: str, user: str, t: datetime, all_github: bool = True
 ) -> Dataset.UserFeature:
     """Get user data before a certain time t"""
-    feat = Dataset.UserFeature(name=user)
+    return _get_user_data_bulk(owner, name, [user], t, all_github)[user]
+
+
+def _count_by(queryset, field: str) -> Counter:
+    """Count documents in queryset grouped by a field (server side)"""
+    pipeline = [{"$group": {"_id": "$" + field, "count": {"$sum": 1}}}]
+    return Counter({x["_id"]: x["count"] for x in queryset.aggregate(pipeline)})
+
+
+def _get_user_data_bulk(
+    owner: str, name: str, users: List[str], t: datetime, all_github: bool = True
+) -> Dict[str, Dataset.UserFeature]:
+    """Get data of multiple users before a certain time t, returns {user: feature}"""
+    feats = {user: Dataset.UserFeature(name=user) for user in users}
 
     # The name of deleted GitHub account
-    if user == "ghost":
-        return feat
+    users = [user for user in feats if user != "ghost"]
+    if len(users) == 0:
+        return feats
+
     # "web-flow" is a special account for all web commits (merge/revert/edit/etc...) made on GitHub
-    usrcmts: List[RepoCommit] = list(
+    commit_query = Q(owner=owner, name=name, authored_at__lte=t, committed_at__lte=t)
+    n_commits = _count_by(
+        RepoCommit.objects(commit_query & Q(committer__in=users)), "committer"
+    ) + _count_by(
         RepoCommit.objects(
-            Q(owner=owner, name=name, authored_at__lte=t, committed_at__lte=t)
-            & (Q(committer=user) | Q(author=user, committer="web-flow"))
-        )
+            commit_query
+            & Q(author__in=[u for u in users if u != "web-flow"], committer="web-flow")
+        ),
+        "author",
     )
 
     # Within project features
-    issue_query = Q(
-        owner=owner,
-        name=name,
-        user=user,
-        created_at__lte=t,
-    )
-    usriss: List[RepoIssue] = list(RepoIssue.objects(issue_query & Q(is_pull=False)))
-    usrpulls: List[RepoIssue] = list(RepoIssue.objects(issue_query & Q(is_pull=True)))
-    usriss_resolved: List[ResolvedIssue] = list(
-        ResolvedIssue.objects(
-            owner=owner,
-            name=name,
-            number__in=[
-                i.number for i in usriss if i.state == "closed" and i.closed_at <= t
-            ],
-        )
-    )
-    usr_revolver_cmts = list(i.resolver_commit_num for i in usriss_resolved)
-    feat.n_commits = len(usrcmts)
-    feat.n_issues = len(usriss)
-    feat.n_pulls = len(usrpulls)
-    feat.resolver_commits = usr_revolver_cmts
+    issue_query = Q(owner=owner, name=name, user__in=users, created_at__lte=t)
+    n_issues = _count_by(RepoIssue.objects(issue_query & Q(is_pull=False)), "user")
+    n_pulls = _count_by(RepoIssue.objects(issue_query & Q(is_pull=True)), "user")
+    closed_issues = {
+        i.number: i.user
+        for i in RepoIssue.objects(
+            issue_query & Q(is_pull=False, state="closed", closed_at__lte=t)
+        ).only("number", "user")
+    }
+    resolver_commits = {user: [] for user in users}
+    for i in ResolvedIssue.objects(
+        owner=owner, name=name, number__in=list(closed_issues)
+    ).only("number", "resolver_commit_num"):
+        resolver_commits[closed_issues[i.number]].append(i.resolver_commit_num)
+    for user in users:
+        feats[user].n_commits = n_commits[user]
+        feats[user].n_issues = n_issues[user]
+        feats[user].n_pulls = n_pulls[user]
+        feats[user].resolver_commits = resolver_commits[user]
 
     # GitHub global features
     if all_github:
-        query = User.objects(login=user)
-
-        if query.count() == 0:
-            return feat
-
-        user: User = query.first()
-        commits = [c for c in user.commit_contributions if c.created_at <= t]
-        issues = [i for i in user.issues if i.created_at <= t]
-        pulls = [p for p in user.pulls if p.created_at <= t]
-        reviews = [r for r in user.pull_reviews if r.created_at <= t]
-        feat.n_commits_all = sum(c.commit_count for c in commits)
-        feat.n_issues_all = len(issues)
-        feat.n_pulls_all = len(pulls)
-        feat.n_reviews_all = len(reviews)
-        feat.max_stars_commit = max([c.repo_stars for c in commits] + [0])
-        feat.max_stars_issue = max([i.repo_stars for i in issues] + [0])
-        feat.max_stars_pull = max([p.repo_stars for p in pulls] + [0])
-        feat.max_stars_review = max([r.repo_stars for r in reviews] + [0])
-        feat.n_repos = len(
-            set((x.owner, x.name) for x in commits + issues + pulls + reviews)
-        )
+        for user in User.objects(login__in=users):
+            feat = feats[user.login]
+            commits = [c for c in user.commit_contributions if c.created_at <= t]
+            issues = [i for i in user.issues if i.created_at <= t]
+            pulls = [p for p in user.pulls if p.created_at <= t]
+            reviews = [r for r in user.pull_reviews if r.created_at <= t]
+            feat.n_commits_all = sum(c.commit_count for c in commits)
+            feat.n_issues_all = len(issues)
+            feat.n_pulls_all = len(pulls)
+            feat.n_reviews_all = len(reviews)
+            feat.max_stars_commit = max([c.repo_stars for c in commits] + [0])
+            feat.max_stars_issue = max([i.repo_stars for i in issues] + [0])
+            feat.max_stars_pull = max([p.repo_stars for p in pulls] + [0])
+            feat.max_stars_review = max([r.repo_stars for r in reviews] + [0])
+            feat.n_repos = len(
+                set((x.owner, x.name) for x in commits + issues + pulls + reviews)
+            )
+
+    return feats
+
+
+class _RepoBackground(object):
+    """
+    Time-sorted history of a repository, loaded once (lazily) and then used to
+        answer background features before any time t with binary searches.
+    An issue counts as closed at t if it is created and closed before t, and a
+        commit counts at t if it is both authored and committed before t.
+    """
 
-    return feat
+    def __init__(self, owner: str, name: str):
+        self.owner = owner
+        self.name = name
+        self._loaded = False
 
+    def _load(self):
+        if self._loaded:
+            return
+        owner, name = self.owner, self.name
 
-def _get_background_data(owner: str, name: str, t: datetime):
-    """Retrieve additional data for computing background related features"""
-    all_issues: List[RepoIssue] = list(
-        RepoIssue.objects(owner=owner, name=name, is_pull=False, created_at__lte=t)
-    )
-    all_commits: List[RepoCommit] = list(
-        RepoCommit.objects(
-            owner=owner,
-            name=name,
-            authored_at__lte=t,
-            committed_at__lte=t,
+        repo: Repo = (
+            Repo.objects(owner=owner, name=name)
+            .only("monthly_stars", "monthly_pulls", "monthly_commits")
+            .first()
+        )
+        # month -> cumulative count, for stars, pulls, and commits
+        self._monthly: List[Tuple[List[datetime], List[int]]] = []
+        for monthly in (repo.monthly_stars, repo.monthly_pulls, repo.monthly_commits):
+            monthly = sorted((x.month, x.count) for x in monthly)
+            self._monthly.append(
+                (
+                    [x[0] for x in monthly],
+                    list(itertools.accumulate(x[1] for x in monthly)),
+                )
+            )
+
+        issues: List[RepoIssue] = list(
+            RepoIssue.objects(owner=owner, name=name, is_pull=False).only(
+                "state", "created_at", "closed_at"
+            )
+        )
+        self._issue_created = sorted(i.created_at for i in issues)
+        closed = sorted(
+            (
+                max(i.created_at, i.closed_at),
+                (i.closed_at - i.created_at).total_seconds(),
+            )
+            for i in issues
+            if i.state == "closed" and i.closed_at is not None
+        )
+        self._issue_closed = [c[0] for c in closed]
+        self._issue_close_times = [c[1] for c in closed]
+
+        # A contributor joins at the first commit they authored or committed
+        first_seen: Dict[str, datetime] = {}
+        commits = RepoCommit.objects(owner=owner, name=name)
+        for field in ("author", "committer"):
+            for x in commits.aggregate(
+                [
+                    {
+                        "$group": {
+                            "_id": "$" + field,
+                            "since": {
+                                "$min": {"$max": ["$authored_at", "$committed_at"]}
+                            },
+                        }
+                    }
+                ]
+            ):
+                user, t = x["_id"], x["since"]
+                if user not in first_seen or t < first_seen[user]:
+                    first_seen[user] = t
+        contributors = sorted(first_seen.items(), key=lambda x: x[1])
+        self._contributors = [c[0] for c in contributors]
+        self._contributor_since = [c[1] for c in contributors]
+
+        resolved = sorted(
+            (i.resolved_at, i.resolver_commit_num)
+            for i in ResolvedIssue.objects(owner=owner, name=name).only(
+                "resolved_at", "resolver_commit_num"
+            )
+        )
+        self._resolved_at = [r[0] for r in resolved]
+        self._resolver_commits = [r[1] for r in resolved]
+
+        self._loaded = True
+
+    def monthly_counts(self, t: datetime) -> Tuple[int, int, int]:
+        """Returns total number of stars, pulls, and commits before t"""
+        self._load()
+        counts = []
+        for months, cumsum in self._monthly:
+            i = bisect.bisect_right(months, t)
+            counts.append(cumsum[i - 1] if i > 0 else 0)
+        return tuple(counts)
+
+    def background(self, t: datetime):
+        """Returns contributors, n_closed_issues, n_open_issues, issue_close_times"""
+        self._load()
+        n_closed_issues = bisect.bisect_right(self._issue_closed, t)
+        n_issues = bisect.bisect_right(self._issue_created, t)
+        contributors = set(
+            self._contributors[: bisect.bisect_right(self._contributor_since, t)]
+        )
+        return (
+            contributors,
+            n_closed_issues,
+            n_issues - n_closed_issues,
+            self._issue_close_times[:n_closed_issues],
         )
-    )
-    contributors, n_closed_issues, n_open_issues, issue_close_times = set(), 0, 0, []
-    for i in all_issues:
-        if i.state == "closed" and i.closed_at <= t:
-            n_closed_issues += 1
-            issue_close_times.append((i.closed_at - i.created_at).total_seconds())
-        else:
-            n_open_issues += 1
-    for c in all_commits:
-        contributors.update((c.author, c.committer))
-    return contributors, n_closed_issues, n_open_issues, issue_close_times
+
+    def prev_resolver_commits(self, t: datetime) -> List[int]:
+        """Resolver commits of all issues resolved before t"""
+        self._load()
+        return self._resolver_commits[: bisect.bisect_right(self._resolved_at, t)]
 
 
 def _get_dynamics_data(owner: str, name: str, events: List[IssueEvent], t: datetime):
-    """Retrieve additional data for computing dynamics related features"""
+    """Retrieve additional data for computing dynamics related features
+    Events should be sorted by time, and those after t are skipped
+    """
     labels, comments, comment_users, event_users = [], [], set(), set()
+    # positions of each label in labels, so that unlabeling does not scan the list
+    label_pos: Dict[str, Deque[int]] = {}
     for event in events:
-        if event.time <= t:
+        if event.time > t:
+            break
+        if event.actor is not None and event.actor != "ghost":
+            event_users.add(event.actor)
+        if event.type == "labeled":
+            label_pos.setdefault(event.label, deque()).append(len(labels))
+            labels.append(event.label)
+        elif event.type == "unlabeled":
+            # Old GitHub issues do not have all labels in event list
+            # In this case, we just ignore them
+            if label_pos.get(event.label):
+                # like list.remove(), drop the first occurrence
+                labels[label_pos[event.label].popleft()] = None
+        elif event.type == "commented":
+            comments.append(event.comment)
             if event.actor is not None and event.actor != "ghost":
-                event_users.add(event.actor)
-            if event.type == "labeled":
-                labels.append(event.label)
-            elif event.type == "unlabeled":
-                # Old GitHub issues do not have all labels in event list
-                # In this case, we just ignore them
-                if event.label in labels:
-                    labels.remove(event.label)
-            elif event.type == "commented":
-                comments.append(event.comment)
-                if event.actor is not None and event.actor != "ghost":
-                    comment_users.add(event.actor)
-    comment_users = [
-        _get_user_data(owner, name, user, t, False) for user in comment_users
-    ]
-    event_users = [_get_user_data(owner, name, user, t, False) for user in event_users]
+                comment_users.add(event.actor)
+    # commenters are also event actors, so resolve all users with one bulk query
+    feats = _get_user_data_bulk(
+        owner, name, list(comment_users | event_users), t, False
+    )
+    comment_users = [feats[user] for user in comment_users]
+    event_users = [feats[user] for user in event_users]
+    labels = [label for label in labels if label is not None]
     return labels, comments, comment_users, event_users
 
 
-def get_dataset(issue: Union[OpenIssue, ResolvedIssue], before: datetime) -> Dataset:
-    """For a resolved or open issue, get the corresponding data for RecGFI training."""
+def get_dataset(
+    issue: Union[OpenIssue, ResolvedIssue],
+    before: datetime,
+    background: _RepoBackground = None,
+    prechecked: bool = False,
+) -> Dataset:
+    """For a resolved or open issue, get the corresponding data for RecGFI training.
+    Pass a shared background to reuse repository history across issues of the same repo.
+    Set prechecked if outdated and existing entries of this issue have already been
+        handled by the caller (e.g., with _get_existing_datasets), to skip those queries.
+    """
     query = Q(owner=issue.owner, name=issue.name, number=issue.number)
 
-    if isinstance(issue, ResolvedIssue):
-        Dataset.objects(query & Q(resolver_commit_num=-1)).delete()
+    if not prechecked:
+        if isinstance(issue, ResolvedIssue):
+            Dataset.objects(query & Q(resolver_commit_num=-1)).delete()
 
-    existing = Dataset.objects(query & Q(before=before))
-    if existing.count() > 0:
-        logger.info(
-            f"{issue.owner}/{issue.name}#{issue.number}-{before}: Already in dataset"
-        )
-        return existing.first()
+        existing = Dataset.objects(query & Q(before=before)).first()
+        if existing is not None:
+            logger.info(
+                f"{issue.owner}/{issue.name}#{issue.number}-{before}: Already in dataset"
+            )
+            return existing
 
     repo_issue: RepoIssue = RepoIssue.objects(query).first()
     if repo_issue.is_pull == True:
         logger.error(f"{issue.owner}/{issue.name}#{issue.number}: Pull Request")
         return
 
-    repo: Repo = Repo.objects(owner=issue.owner, name=issue.name).first()
-    contribs, n_closed, n_open, close_times = _get_background_data(
-        issue.owner, issue.name, before
-    )
-    prev_resolver_commits = [
-        x.resolver_commit_num
-        for x in ResolvedIssue.objects(
-            name=issue.name, owner=issue.owner, resolved_at__lte=before
-        )
-    ]
+    if background is None:
+        background = _RepoBackground(issue.owner, issue.name)
+    contribs, n_closed, n_open, close_times = background.background(before)
+    prev_resolver_commits = background.prev_resolver_commits(before)
+    # GitHub timelines are chronological, so this sort is usually a linear scan
+    events = sorted(issue.events, key=lambda e: e.time)
+    times = [e.time for e in events]
     labels, comments, comment_users, event_users = _get_dynamics_data(
-        issue.owner, issue.name, issue.events, before
+        issue.owner, issue.name, events[: bisect.bisect_right(times, before)], before
     )
-    clean_body = _delete_urls(_delete_code_snippets(repo_issue.body))
+    body = _analyze_body(repo_issue.body)
 
     data = Dataset()
 
@@ -318,37 +505,38 @@ def get_dataset(issue: Union[OpenIssue, ResolvedIssue], before: datetime) -> Dat
 
     # ---------- Content ----------
     data.title = repo_issue.title
-    data.body = clean_body
+    data.body = body.clean_body
     data.len_title = _count_text_len(repo_issue.title)
-    data.len_body = _count_text_len(clean_body)
-    data.n_code_snips = _count_code_snippets(repo_issue.body)
-    data.n_urls = _count_urls(repo_issue.body)
-    data.n_imgs = _count_imgs(repo_issue.body)
-    data.coleman_liau_index = textstat.coleman_liau_index(clean_body)
-    data.flesch_reading_ease = textstat.flesch_reading_ease(clean_body)
-    data.flesch_kincaid_grade = textstat.flesch_kincaid_grade(clean_body)
-    data.automated_readability_index = textstat.automated_readability_index(clean_body)
+    data.len_body = body.len_body
+    data.n_code_snips = body.n_code_snips
+    data.n_urls = body.n_urls
+    data.n_imgs = body.n_imgs
+    (
+        data.coleman_liau_index,
+        data.flesch_reading_ease,
+        data.flesch_kincaid_grade,
+        data.automated_readability_index,
+    ) = _readability_all(body.clean_body)
     data.labels = labels
     data.label_category = _get_categorized_labels(labels)
 
     # ---------- Background ----------
-    data.reporter_feat = _get_user_data(
-        issue.owner, issue.name, repo_issue.user, before
+    feats = _get_user_data_bulk(
+        issue.owner, issue.name, [repo_issue.user, issue.owner], before
     )
-    data.owner_feat = _get_user_data(issue.owner, issue.name, issue.owner, before)
+    data.reporter_feat = feats[repo_issue.user]
+    data.owner_feat = feats[issue.owner]
     data.prev_resolver_commits = prev_resolver_commits
-    data.n_stars = sum(x.count for x in repo.monthly_stars if x.month <= before)
-    data.n_pulls = sum(x.count for x in repo.monthly_pulls if x.month <= before)
-    data.n_commits = sum(x.count for x in repo.monthly_commits if x.month <= before)
+    data.n_stars, data.n_pulls, data.n_commits = background.monthly_counts(before)
     data.n_contributors = len(contribs)
     data.n_closed_issues = n_closed
     data.n_open_issues = n_open
     data.r_open_issues = n_open / (n_open + n_closed) if n_open + n_closed > 0 else 0
-    data.issue_close_time = np.median(close_times) if len(close_times) > 0 else 0
+    data.issue_close_time = statistics.median(close_times) if close_times else 0
 
     # ---------- Dynamics ----------
     data.comments = comments
-    data.events = [e.type for e in issue.events if e.time < before]
+    data.events = [e.type for e in events[: bisect.bisect_left(times, before)]]
     data.comment_users = comment_users
     data.event_users = event_users
 
@@ -356,12 +544,145 @@ def get_dataset(issue: Union[OpenIssue, ResolvedIssue], before: datetime) -> Dat
     return data
 
 
+def _should_update_open_issue(iss: OpenIssue) -> bool:
+    """Whether an open issue has changed since its dataset entry was built, deletes outdated entries"""
+    if len(iss.events) > 0:
+        last_updated = max(e.time for e in iss.events)
+    else:
+        last_updated = iss.created_at
+
+    existing = Dataset.objects(name=iss.name, owner=iss.owner, number=iss.number).only(
+        "before"
+    )
+    latest = existing.first()
+    if latest is not None and latest.before >= last_updated:
+        logger.info("%s/%s#%d: no need to update", iss.owner, iss.name, iss.number)
+        return False
+    existing.delete()
+    return True
+
+
+# Per-process repository backgrounds for dataset workers
+_worker_backgrounds: Dict[Tuple[str, str], _RepoBackground] = {}
+
+
+def _init_dataset_worker():
+    mongoengine.disconnect_all()
+    mongoengine.connect(
+        CONFIG["mongodb"]["db"],
+        host=CONFIG["mongodb"]["url"],
+        tz_aware=True,
+        uuidRepresentation="standard",
+    )
+    _worker_backgrounds.clear()
+
+
+def _get_dataset_worker(task: Tuple[str, str, str, int, datetime]):
+    """Build one dataset entry in a worker process from a picklable task"""
+    kind, owner, name, number, before = task
+    cls = ResolvedIssue if kind == "resolved" else OpenIssue
+    issue = cls.objects(owner=owner, name=name, number=number).first()
+    if (owner, name) not in _worker_backgrounds:
+        _worker_backgrounds[owner, name] = _RepoBackground(owner, name)
+    get_dataset(issue, before, _worker_backgrounds[owner, name], prechecked=True)
+    return owner, name, number
+
+
+def _get_existing_datasets(
+    resolved_issues: List[ResolvedIssue],
+) -> Set[Tuple[str, str, int, datetime]]:
+    """
+    Delete entries built when resolved issues were still open, and return
+        (owner, name, number, before) of the remaining entries, with one query per repo
+    """
+    numbers: Dict[Tuple[str, str], List[int]] = {}
+    for iss in resolved_issues:
+        numbers.setdefault((iss.owner, iss.name), []).append(iss.number)
+
+    existing = set()
+    for (owner, name), nums in numbers.items():
+        query = Q(owner=owner, name=name, number__in=nums)
+        Dataset.objects(query & Q(resolver_commit_num=-1)).delete()
+        for x in Dataset.objects(query).only("number", "before"):
+            existing.add((owner, name, x.number, x.before))
+    logger.info("%d dataset entries of resolved issues already exist", len(existing))
+    return existing
+
+
+def _get_dataset_parallel(
+    pool: mp.Pool,
+    kind: str,
+    issues: List[Union[OpenIssue, ResolvedIssue]],
+    existing: Set[Tuple[str, str, int, datetime]],
+):
+    """Build dataset entries of resolved or open issues with a pool of dataset workers,
+        skipping (owner, name, number, before) already in existing
+    """
+    tasks = set()
+    for iss in issues:
+        befores = (
+            [iss.created_at, iss.resolved_at]
+            if kind == "resolved"
+            else [iss.updated_at]
+        )
+        for before in befores:
+            if (iss.owner, iss.name, iss.number, before) in existing:
+                continue
+            tasks.add(
+                (len(iss.events), (kind, iss.owner, iss.name, iss.number, before))
+            )
+    # Start with the most expensive issues to avoid stragglers at the end
+    tasks = [task for _, task in sorted(tasks, key=lambda x: x[0], reverse=True)]
+    for i, (owner, name, number) in enumerate(
+        pool.imap_unordered(_get_dataset_worker, tasks)
+    ):
+        logger.info(
+            "%s/%s#%d is done (%d of %d %s tasks)",
+            owner,
+            name,
+            number,
+            i,
+            len(tasks),
+            kind,
+        )
+
+
 def get_dataset_with_issues(
-    resolved_issues: List[ResolvedIssue], open_issues: List[OpenIssue]
+    resolved_issues: List[ResolvedIssue],
+    open_issues: List[OpenIssue],
+    n_process: int = None,
 ):
+    """Build dataset entries for the given resolved and open issues.
+
+    Args:
+        n_process (int, optional): Number of processes to use. Defaults to None,
+            which builds everything in the current process. Worker processes
+            can not be spawned from a daemonic process (e.g., get_dataset_all workers).
+    """
+    existing = _get_existing_datasets(resolved_issues)
+
+    if n_process is not None:
+        with mp.Pool(n_process, initializer=_init_dataset_worker) as pool:
+            _get_dataset_parallel(pool, "resolved", resolved_issues, existing)
+            _get_dataset_parallel(
+                pool,
+                "open",
+                [i for i in open_issues if _should_update_open_issue(i)],
+                set(),
+            )
+        return
+
+    backgrounds: Dict[Tuple[str, str], _RepoBackground] = {}
+
+    def get_background(iss: Union[OpenIssue, ResolvedIssue]) -> _RepoBackground:
+        if (iss.owner, iss.name) not in backgrounds:
+            backgrounds[iss.owner, iss.name] = _RepoBackground(iss.owner, iss.name)
+        return backgrounds[iss.owner, iss.name]
+
     for i, iss in enumerate(resolved_issues):
-        get_dataset(iss, iss.created_at)
-        get_dataset(iss, iss.resolved_at)
+        for before in dict.fromkeys((iss.created_at, iss.resolved_at)):
+            if (iss.owner, iss.name, iss.number, before) not in existing:
+                get_dataset(iss, before, get_background(iss), prechecked=True)
         logger.info(
             "%s/%s#%d is done (%d of %d resolved issues)",
             iss.owner,
@@ -373,18 +694,10 @@ def get_dataset_with_issues(
 
     for i, iss in enumerate(open_issues):
         # determine whether this issue needs to be updated
-        if len(iss.events) > 0:
-            last_updated = max(e.time for e in iss.events)
-        else:
-            last_updated = iss.created_at
-
-        existing = Dataset.objects(name=iss.name, owner=iss.owner, number=iss.number)
-        if existing.count() > 0 and existing.first().before >= last_updated:
-            logger.info("%s/%s#%d: no need to update", iss.owner, iss.name, iss.number)
+        if not _should_update_open_issue(iss):
             continue
-        existing.delete()
 
-        get_dataset(iss, iss.updated_at)
+        get_dataset(iss, iss.updated_at, get_background(iss), prechecked=True)
         logger.info(
             "%s/%s#%d is done (%d of %d open issues)",
             iss.owner,
@@ -401,9 +714,11 @@ def get_dataset_for_repo(
     since: datetime,
     github_login: str = None,
     init_db: bool = False,
+    n_process: int = None,
 ):
     """
     Update the Dataset collection with latest resolved and open issues for a single repo.
+    If n_process is given, issues of this repo are processed with multiple processes.
     """
     if init_db:
         mongoengine.disconnect_all()
@@ -442,7 +757,7 @@ def get_dataset_for_repo(
         len(resolved_issues),
         len(open_issues),
     )
-    get_dataset_with_issues(resolved_issues, open_issues)
+    get_dataset_with_issues(resolved_issues, open_issues, n_process)
 
     log.updated_open_issues = len(open_issues)
     log.updated_resolved_issues = len(resolved_issues)
@@ -459,11 +774,14 @@ def get_dataset_all(since: datetime, n_process: int = None):
         n_process (int, optional): Number of processes to use. Defaults to None
     """
     if n_process is None:
-        repos = [(r.owner, r.name) for r in Repo.objects()]
+        repos = [(r.owner, r.name) for r in Repo.objects().only("owner", "name")]
         for owner, name in repos:
             get_dataset_for_repo(owner, name, since)
     else:
-        params = [(r.owner, r.name, since, None, True) for r in Repo.objects()]
+        params = [
+            (r.owner, r.name, since, None, True)
+            for r in Repo.objects().only("owner", "name")
+        ]
         with mp.Pool(n_process) as p:
             p.starmap(get_dataset_for_repo, params)
 
@@ -1,6 +1,7 @@
 import gfibot.data.dataset as d
 
 from datetime import datetime, timezone
+from multiprocessing.dummy import Pool
 from bson.json_util import DEFAULT_JSON_OPTIONS
 from gfibot.collections import *
 
@@ -575,12 +576,39 @@ def test_utils():
     assert d._count_imgs("https://example.com\nhttp://example.com") == 0
     assert d._count_imgs("https://example.com jpeg\nhttp://example.com/a.jpeg") == 1
 
+    assert d._scan_urls(None) == (0, 0)
+    assert d._scan_urls("") == (0, 0)
+    assert d._scan_urls("http://example.com http://example.com/a.png") == (1, 1)
+
     assert d._count_text_len(None) == 0
     assert d._count_text_len("") == 0
     assert d._count_text_len("abc") == 1
     assert d._count_text_len("abc abc") == 2
     assert d._count_text_len("abc   abc") == 2
 
+    for body in [
+        None,
+        "",
+        "plain text",
+        "```code``` http://example.com/a.png text http://example.com",
+        "```http://example.com``` ```code```\nhttp://example.com words here",
+    ]:
+        assert d._analyze_body(body) == (
+            d._count_code_snippets(body),
+            d._count_urls(body),
+            d._count_imgs(body),
+            d._count_text_len(d._delete_urls(d._delete_code_snippets(body))),
+            d._delete_urls(d._delete_code_snippets(body)),
+        )
+
+    text = "This is a sentence. This is another, longer sentence!"
+    assert d._readability_all(text) == (
+        d.textstat.coleman_liau_index(text),
+        d.textstat.flesch_reading_ease(text),
+        d.textstat.flesch_kincaid_grade(text),
+        d.textstat.automated_readability_index(text),
+    )
+
 
 def test_label_categorization():
     label_cats = {
@@ -613,20 +641,51 @@ def test_get_user_data(mock_mongodb):
     assert user.n_issues_all == 1
 
 
+def test_get_user_data_bulk(mock_mongodb):
+    t = datetime.now(timezone.utc)
+    users = d._get_user_data_bulk("owner", "name", ["a1", "a2", "ghost"], t)
+    assert list(users) == ["a1", "a2", "ghost"]
+    for login, user in users.items():
+        assert user.to_mongo() == d._get_user_data("owner", "name", login, t).to_mongo()
+    assert users["a2"].n_issues == 1 and users["a2"].n_commits == 0
+
+
 def test_get_background_data(mock_mongodb):
-    contribs, n_closed, n_open, cls_time = d._get_background_data(
-        "owner", "name", datetime.now(timezone.utc)
+    background = d._RepoBackground("owner", "name")
+    contribs, n_closed, n_open, cls_time = background.background(
+        datetime.now(timezone.utc)
     )
     assert contribs == {"a1"}
     assert n_closed == 2
     assert n_open == 1
     assert cls_time == [86400.0, 86400.0]
 
-    contribs, n_closed, n_open, cls_time = d._get_background_data(
-        "owner", "name", datetime(2022, 1, 3, tzinfo=timezone.utc)
+    contribs, n_closed, n_open, cls_time = background.background(
+        datetime(2022, 1, 3, tzinfo=timezone.utc)
     )
     assert n_closed == 1 and n_open == 1
 
+    assert background.monthly_counts(datetime(2021, 12, 1, tzinfo=timezone.utc)) == (
+        0,
+        0,
+        0,
+    )
+    assert background.monthly_counts(datetime(2022, 1, 1, tzinfo=timezone.utc)) == (
+        1,
+        1,
+        1,
+    )
+    assert background.prev_resolver_commits(
+        datetime(2022, 1, 3, tzinfo=timezone.utc)
+    ) == [0]
+    assert background.prev_resolver_commits(datetime.now(timezone.utc)) == [0, 1]
+    assert background.background(datetime(2021, 1, 1, tzinfo=timezone.utc)) == (
+        set(),
+        0,
+        0,
+        [],
+    )
+
 
 def test_get_dynamics_data(mock_mongodb):
     issue = ResolvedIssue.objects(name="name", owner="owner", number=2).first()
@@ -641,9 +700,81 @@ def test_get_dynamics_data(mock_mongodb):
     assert {u.name for u in event_users} == {"a1", "a2"}
 
 
+def test_get_dynamics_data_label_churn(mock_mongodb):
+    def event(type, label, day):
+        return IssueEvent(
+            type=type, label=label, time=datetime(2022, 1, day, tzinfo=timezone.utc)
+        )
+
+    events = [
+        event("labeled", "A", 1),
+        event("labeled", "B", 2),
+        event("labeled", "A", 3),
+        event("unlabeled", "A", 4),
+        event("unlabeled", "C", 5),  # labeled before the event list starts
+        event("unlabeled", "B", 6),
+        event("labeled", "B", 7),
+    ]
+    for day, expected in [
+        (3, ["A", "B", "A"]),
+        (4, ["B", "A"]),
+        (5, ["B", "A"]),
+        (7, ["A", "B"]),
+    ]:
+        labels, _, _, _ = d._get_dynamics_data(
+            "owner", "name", events, datetime(2022, 1, day, tzinfo=timezone.utc)
+        )
+        assert labels == expected
+
+
 def test_get_dataset(mock_mongodb):
     for resolved_issue in ResolvedIssue.objects():
         d1 = d.get_dataset(resolved_issue, resolved_issue.resolved_at)
         d2 = d.get_dataset(resolved_issue, resolved_issue.created_at)
         print(d1.to_json(indent=2, json_options=DEFAULT_JSON_OPTIONS))
         print(d2.to_json(indent=2, json_options=DEFAULT_JSON_OPTIONS))
+
+
+def test_get_existing_datasets(mock_mongodb):
+    resolved_issues = list(ResolvedIssue.objects())
+    existing = d._get_existing_datasets(resolved_issues)
+    assert existing == {
+        (i.owner, i.name, i.number, before)
+        for i in resolved_issues
+        for before in (i.created_at, i.resolved_at)
+    }
+
+
+
+def test_get_dataset_with_issues_same_before(mock_mongodb):
+    # an issue created and closed in the same second has only one entry
+    issue = ResolvedIssue.objects(owner="owner", name="name", number=1).first()
+    issue.resolved_at = issue.created_at
+    Dataset.objects(owner="owner", name="name", number=1).delete()
+    d.get_dataset_with_issues([issue], [])
+    assert Dataset.objects(owner="owner", name="name", number=1).count() == 1
+
+def test_get_dataset_parallel(mock_mongodb):
+    resolved_issues = list(ResolvedIssue.objects())
+    numbers = [i.number for i in resolved_issues]
+
+    def dump():
+        rows = []
+        for x in Dataset.objects(number__in=numbers).order_by("number", "before"):
+            row = x.to_mongo().to_dict()
+            row.pop("_id")
+            rows.append(row)
+        return rows
+
+    # the fixture builds its entries before users are saved, so rebuild them here
+    Dataset.objects(number__in=numbers).delete()
+    for i in resolved_issues:
+        for before in (i.created_at, i.resolved_at):
+            d.get_dataset(i, before)
+    serial = dump()
+    assert len(serial) == 2 * len(resolved_issues)
+
+    Dataset.objects(number__in=numbers).delete()
+    with Pool(2) as pool:
+        d._get_dataset_parallel(pool, "resolved", resolved_issues, set())
+    assert dump() == serial